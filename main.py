@@ -6,16 +6,38 @@ import time
 from io import BytesIO
 from typing import List
 import hashlib
+import bisect
+import re
+import sqlite3
+import gzip
+import tempfile
+import mimetypes
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from contextlib import asynccontextmanager
+from urllib.parse import quote
 
-from fastapi import FastAPI, Form, UploadFile, File, HTTPException
+from fastapi import FastAPI, Form, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
-from telethon import TelegramClient, errors, Button
-from telethon.tl import functions
+from telethon import TelegramClient, errors, Button, utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.tl import functions, types
 import asyncio
-from datetime import datetime
+from datetime import datetime, timezone
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; thumbnails fall back to the original file
+    Image = None
+    ImageOps = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
 
 # ----- Logging -----
 logging.basicConfig(level=logging.INFO)
@@ -24,13 +46,87 @@ logging.basicConfig(level=logging.INFO)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
+    build_static_assets()
+    await sync_media_folders()
     await load_clients()
-    asyncio.create_task(run_scheduler())
+    global shutdown_event, inflight_idle
+    shutdown_event = asyncio.Event()
+    inflight_idle = asyncio.Event()
+    inflight_idle.set()
+    scheduler_task = asyncio.create_task(run_scheduler())
+    start_job_workers()
     yield
-    # Shutdown logic (optional)
-    for c in clients.values():
+    # Shutdown logic: drain, flush, then disconnect everything at once
+    await drain_and_shutdown(scheduler_task)
+
+async def drain_and_shutdown(scheduler_task: asyncio.Task):
+    """Stop starting schedule runs and jobs, let in-flight ones finish within
+    SHUTDOWN_DRAIN_SECONDS, flush buffered state and disconnect all clients concurrently.
+    HTTP requests are already drained by uvicorn before lifespan shutdown runs."""
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SECONDS
+    shutdown_event.set()
+    logging.info("Shutdown: menunggu pekerjaan yang sedang berjalan selesai")
+
+    # The scheduler finishes the schedule it is running, saves and exits
+    try:
+        await asyncio.wait_for(asyncio.shield(scheduler_task), max(0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        logging.warning("Shutdown: scheduler tidak selesai sebelum batas waktu, dibatalkan")
+        scheduler_task.cancel()
+        # Let the cancelled run finish its cleanup (bot client disconnect saves its
+        # session) before the session store is closed below
+        try:
+            await asyncio.wait_for(asyncio.gather(scheduler_task, return_exceptions=True), SHUTDOWN_CANCEL_GRACE_SECONDS)
+        except asyncio.TimeoutError:
+            logging.warning("Shutdown: scheduler tidak berhenti setelah dibatalkan")
+    except Exception as e:
+        logging.error(f"Shutdown: scheduler berhenti dengan error: {e}")
+    try:
+        if not inflight_idle.is_set():
+            await asyncio.wait_for(inflight_idle.wait(), max(0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        logging.warning(f"Shutdown: {inflight_work} pekerjaan masih berjalan saat batas waktu habis")
+    # Jobs still running past the deadline are recorded as interrupted
+    await stop_job_workers()
+
+    # Flush buffered session writes before the connections go away
+    for c in list(clients.values()) + [p["client"] for p in pending_login.values()]:
+        try:
+            c.session.save()
+        except Exception as e:
+            logging.error(f"Shutdown: gagal flush session: {e}")
+
+    async def disconnect(c):
         try: await c.disconnect()
         except Exception: pass
+    to_disconnect = list(clients.values()) + [p["client"] for p in pending_login.values()]
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(disconnect(c) for c in to_disconnect)),
+            max(1, deadline - time.monotonic()),
+        )
+    except asyncio.TimeoutError:
+        logging.warning("Shutdown: sebagian client belum terputus sebelum batas waktu")
+
+    if _image_pool is not None:
+        _image_pool.shutdown(wait=False)
+    if session_store is not None:
+        session_store.close()
+    logging.info(f"Shutdown selesai: {len(to_disconnect)} client diputus")
+
+@asynccontextmanager
+async def track_inflight():
+    """Count a unit of work (schedule run, background job) that shutdown should wait for."""
+    global inflight_work
+    inflight_work += 1
+    if inflight_idle is not None:
+        inflight_idle.clear()
+    try:
+        yield
+    finally:
+        inflight_work -= 1
+        if inflight_work == 0 and inflight_idle is not None:
+            inflight_idle.set()
 
 # ----- App -----
 app = FastAPI(lifespan=lifespan)
@@ -49,16 +145,59 @@ POSTED_FILE = "posted.json"
 ANALYTICS_FILE = "analytics.json"
 MEDIA_FOLDER = "media"
 SESSIONS_FOLDER = "sessions"
+SESSION_BACKEND = "store"        # "store": one SQLite database for all sessions, "file": one .session per account
+SESSION_DB_FILE = os.path.join(SESSIONS_FOLDER, "sessions.db")
 CAPTIONS_FOLDER = "captions"
 CAPTIONS_FILE = os.path.join(CAPTIONS_FOLDER, "captions.txt")
 MARK_POSTED_FOLDER = "mark-posted"
 SCHEDULES_FILE = "schedules.json"
 BOT_SETTINGS_FILE = "bot_settings.json"
+TARGET_CACHE_FILE = "target_cache.json"
+SCHEDULE_HISTORY_FILE = "schedule_history.json"
+SCHEDULE_HISTORY_LIMIT = 100   # runs kept per schedule
+THUMBS_FOLDER = "thumbs"
+THUMB_SIZE = 320
+THUMB_CACHE_MAX_BYTES = 200 * 1024 * 1024
+OPTIMIZED_FOLDER = "optimized"
+OPTIMIZED_CACHE_MAX_BYTES = 500 * 1024 * 1024
+OPTIMIZE_IMAGES = True   # Re-encode images into send-ready variants before upload (needs Pillow)
+TELEGRAM_PHOTO_MAX_SIDE = 2560
+TELEGRAM_PHOTO_MAX_BYTES = 10 * 1024 * 1024
+BLOBS_FOLDER = "blobs"
+MEDIA_INDEX_FILE = "media_index.json"
+STATIC_FOLDER = "static"
+FINGERPRINTED_EXTENSIONS = ('.js', '.css')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+JOBS_FILE = "jobs.json"
+JOB_CONCURRENCY = 2              # background jobs running at the same time
+JOBS_HISTORY_LIMIT = 200
+SHUTDOWN_DRAIN_SECONDS = 20     # how long shutdown waits for in-flight work
+SHUTDOWN_CANCEL_GRACE_SECONDS = 5  # extra time for cancelled work to clean up
+SEND_ERROR_CODES = ("flood_wait", "write_forbidden", "not_participant", "private", "unknown")
+ACCOUNT_RPC_CONCURRENCY = 1      # RPCs in flight per account
+FLOOD_HOLD_MAX_SECONDS = 60      # hold queued work for flood waits up to this long, fail fast beyond
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
 
 # ----- Global storage -----
 clients = {}
 accounts_cache: List[dict] = []
 pending_login = {}
+dispatchers = {}          # account_id -> AccountDispatcher
+account_profiles = {}     # account_id -> last successful get_me() result
+session_store = None
+shutdown_event = None     # set when shutdown starts; created in lifespan
+inflight_idle = None      # set while no tracked work is running
+inflight_work = 0
+jobs = {}                 # job_id -> job record (persisted in JOBS_FILE)
+job_tasks = {}            # job_id -> asyncio.Task of a running job
+job_workers = []
+job_queue = None          # created in lifespan
+_last_progress_save = 0.0
+_image_pool = None
+_disk_lrus = {}           # cache folder -> OrderedDict: filename -> size in bytes (oldest first)
+_image_jobs_inflight = {} # output path -> asyncio.Future
+static_assets = {}        # fingerprinted name -> {"media_type", "identity", "gzip", "br"}
+index_page = {}           # rewritten index.html, same encodings as static_assets
 
 # ----- Helpers -----
 def ensure_file_exists(path: str, default):
@@ -71,6 +210,9 @@ def ensure_file_exists(path: str, default):
 os.makedirs(MEDIA_FOLDER, exist_ok=True)
 os.makedirs(CAPTIONS_FOLDER, exist_ok=True)
 os.makedirs(MARK_POSTED_FOLDER, exist_ok=True)
+os.makedirs(BLOBS_FOLDER, exist_ok=True)
+os.makedirs(THUMBS_FOLDER, exist_ok=True)
+os.makedirs(OPTIMIZED_FOLDER, exist_ok=True)
 ensure_file_exists(SCHEDULES_FILE, [])
 ensure_file_exists(BOT_SETTINGS_FILE, {"bot_token": ""})
 
@@ -146,14 +288,49 @@ def save_analytics(data: dict):
     """Save analytics data to JSON file"""
     save_json(ANALYTICS_FILE, data)
 
-def log_send_result(account_id: str, group: str, success: bool, error_message: str = ""):
-    """Log the result of a send operation"""
+def _classify_error_message(error_message: str):
+    """Map a free-form send error message (as logged by post_to_group) to (code, flood_seconds)."""
+    msg = (error_message or "").lower()
+    match = re.search(r"flood wait (\d+)", msg)
+    if match:
+        return "flood_wait", int(match.group(1))
+    if "write forbidden" in msg:
+        return "write_forbidden", 0
+    if "belum bergabung" in msg or "not a participant" in msg:
+        return "not_participant", 0
+    if "private" in msg:
+        return "private", 0
+    return "unknown", 0
+
+
+def _build_error_index(sends: List[dict]) -> dict:
+    """Secondary index of failures: code -> time-ordered [timestamp, account_id, group, flood_seconds]."""
+    index = {code: [] for code in SEND_ERROR_CODES}
+    for send in sends:
+        if send.get("success"):
+            continue
+        code = send.get("error_code")
+        seconds = send.get("flood_seconds", 0)
+        if code not in index:
+            code, seconds = _classify_error_message(send.get("error_message", ""))
+        index[code].append([send.get("timestamp", 0), send.get("account_id"), send.get("group"), seconds])
+    for rows in index.values():
+        rows.sort()
+    return index
+
+
+def log_send_result(account_id: str, group: str, success: bool, error_message: str = "",
+                    error_code: str = "", flood_seconds: int = 0):
+    """Log the result of a send operation. Failures are classified into
+    SEND_ERROR_CODES (from error_message when error_code is not given)."""
     try:
         analytics = load_analytics()
         
         # Initialize structure if needed
         if "sends" not in analytics:
             analytics["sends"] = []
+        if "error_index" not in analytics:
+            analytics["error_index"] = _build_error_index(analytics["sends"])
         
         # Add new log entry
         log_entry = {
@@ -163,16 +340,64 @@ def log_send_result(account_id: str, group: str, success: bool, error_message: s
             "error_message": error_message,
             "timestamp": time.time()
         }
+        if not success:
+            if error_code not in SEND_ERROR_CODES:
+                error_code, flood_seconds = _classify_error_message(error_message)
+            log_entry["error_code"] = error_code
+            log_entry["flood_seconds"] = flood_seconds
+            analytics["error_index"].setdefault(error_code, []).append(
+                [log_entry["timestamp"], account_id, group, flood_seconds])
         analytics["sends"].append(log_entry)
         
         # Keep only last 10000 entries to prevent file from growing too large
         if len(analytics["sends"]) > 10000:
             analytics["sends"] = analytics["sends"][-10000:]
+            cutoff = [analytics["sends"][0].get("timestamp", 0)]
+            for code, rows in analytics["error_index"].items():
+                analytics["error_index"][code] = rows[bisect.bisect_left(rows, cutoff):]
         
         save_analytics(analytics)
     except Exception as e:
         logging.error(f"Gagal log send result: {e}")
 
+def get_error_breakdown(since: float = None, until: float = None, account_id: str = None, group: str = None) -> dict:
+    """Failure counts per code, account and group, read from the error index"""
+    analytics = load_analytics()
+    index = analytics.get("error_index")
+    if index is None:
+        index = _build_error_index(analytics.get("sends", []))
+
+    totals = {code: 0 for code in SEND_ERROR_CODES}
+    accounts = {}
+    groups = {}
+    flood_seconds = []
+    for code, rows in index.items():
+        # Rows are time-ordered, so the time window is a slice
+        lo = bisect.bisect_left(rows, [since]) if since is not None else 0
+        hi = bisect.bisect_left(rows, [until + 1e-6]) if until is not None else len(rows)
+        for ts, acc, grp, seconds in rows[lo:hi]:
+            if (account_id and acc != account_id) or (group and grp != group):
+                continue
+            totals[code] = totals.get(code, 0) + 1
+            acc_counts = accounts.setdefault(acc, {})
+            acc_counts[code] = acc_counts.get(code, 0) + 1
+            grp_counts = groups.setdefault(grp, {})
+            grp_counts[code] = grp_counts.get(code, 0) + 1
+            if code == "flood_wait":
+                flood_seconds.append(seconds)
+
+    return {
+        "total_failed": sum(totals.values()),
+        "totals": totals,
+        "accounts": accounts,
+        "groups": groups,
+        "flood_wait": {
+            "count": len(flood_seconds),
+            "max_seconds": max(flood_seconds) if flood_seconds else 0,
+            "avg_seconds": round(sum(flood_seconds) / len(flood_seconds), 1) if flood_seconds else 0,
+        },
+    }
+
 def get_analytics_summary(group_a: str = None, group_b: str = None) -> dict:
     """Get analytics summary for accounts"""
     try:
@@ -236,112 +461,661 @@ def _sha256_of_bytes(data: bytes) -> str:
     return h.hexdigest()
 
 
-def _find_file_by_hash(filename: str, data_hash: str) -> str:
-    """If a file with same base name or variant exists and has same hash, return its name; else return empty string."""
+def _sha256_of_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ----- Media Store -----
+# Image bytes live once in BLOBS_FOLDER, named by their sha256. "media" and "posted"
+# are name -> hash maps in MEDIA_INDEX_FILE, so marking an item as posted is a
+# metadata update. MEDIA_FOLDER and MARK_POSTED_FOLDER act as drop-in inboxes:
+# files placed there by hand are ingested by sync_media_folders() at startup or
+# through the sync_media_inbox job, which /media-list submits when it sees them.
+def _blob_path(digest: str) -> str:
+    return os.path.join(BLOBS_FOLDER, digest[:2], digest)
+
+
+def put_blob_bytes(data: bytes) -> str:
+    """Store bytes in the blob store (once) and return their sha256."""
+    digest = _sha256_of_bytes(data)
+    path = _blob_path(digest)
+    if os.path.exists(path):
+        # Refresh mtime so a running orphan cleanup treats the blob as new
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return digest
+
+
+def put_blob_file(src_path: str, digest: str = None) -> str:
+    """Move a file into the blob store (dropping it if the content is already stored)."""
+    digest = digest or _sha256_of_file(src_path)
+    path = _blob_path(digest)
+    if os.path.exists(path):
+        os.remove(src_path)
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(src_path, path)
+    return digest
+
+
+_media_index_cache = None
+
+
+def load_media_index() -> dict:
+    """Load the name -> hash index for media and posted items.
+
+    The index is parsed from disk once and kept in memory; save_media_index()
+    refreshes it. Callers get their own copy, so they can edit it before saving."""
+    global _media_index_cache
+    if _media_index_cache is None:
+        ensure_file_exists(MEDIA_INDEX_FILE, {})
+        try:
+            with open(MEDIA_INDEX_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error(f"Gagal load media index {MEDIA_INDEX_FILE}: {e}")
+            data = {}
+        if not isinstance(data, dict):
+            data = {}
+        data.setdefault("media", {})
+        data.setdefault("posted", {})
+        _media_index_cache = data
+    return {"media": dict(_media_index_cache["media"]), "posted": dict(_media_index_cache["posted"])}
+
+
+def save_media_index(index: dict):
+    global _media_index_cache
+    save_json(MEDIA_INDEX_FILE, index)
+    _media_index_cache = {"media": dict(index["media"]), "posted": dict(index["posted"])}
+
+
+def _unique_name(filename: str, taken) -> str:
+    """Return filename, or base_N.ext if filename is already taken."""
+    if filename not in taken:
+        return filename
     base, ext = os.path.splitext(filename)
-    # Check exact name first
-    cand = os.path.join(MEDIA_FOLDER, filename)
+    counter = 1
+    while f"{base}_{counter}{ext}" in taken:
+        counter += 1
+    return f"{base}_{counter}{ext}"
+
+
+def media_blob_path(filename: str, section: str = "media") -> str:
+    """Blob path of a named media/posted entry, or empty string if unknown."""
+    digest = load_media_index()[section].get(filename)
+    return _blob_path(digest) if digest else ""
+
+
+async def sync_media_folders() -> int:
+    """Ingest loose image files from the media/ and mark-posted/ inboxes into the store.
+
+    Files are hashed off the event loop; the index is updated per file with no
+    await between load and save. Returns the number of files ingested."""
+    loop = asyncio.get_running_loop()
+    ingested = 0
+    for folder, section in ((MEDIA_FOLDER, "media"), (MARK_POSTED_FOLDER, "posted")):
+        os.makedirs(folder, exist_ok=True)
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if not name.lower().endswith(IMAGE_EXTENSIONS) or not os.path.isfile(path):
+                continue
+            try:
+                digest = await loop.run_in_executor(None, _sha256_of_file, path)
+                put_blob_file(path, digest)
+            except Exception as e:
+                logging.error(f"Gagal memindahkan {path} ke blob store: {e}")
+                continue
+            index = load_media_index()
+            entries = index[section]
+            if entries.get(name) != digest:
+                entries[_unique_name(name, entries)] = digest
+                save_media_index(index)
+            ingested += 1
+            logging.info(f"File {name} dimasukkan ke media store ({section})")
+    return ingested
+
+
+def inbox_has_images() -> bool:
+    """Cheap check (listdir only) for loose images waiting in the inboxes."""
+    for folder in (MEDIA_FOLDER, MARK_POSTED_FOLDER):
+        if os.path.isdir(folder) and any(n.lower().endswith(IMAGE_EXTENSIONS) for n in os.listdir(folder)):
+            return True
+    return False
+
+
+def release_blob(digest: str):
+    """Delete a blob that is no longer referenced by media, posted or schedules."""
+    if not digest:
+        return
+    index = load_media_index()
+    if digest in index["media"].values() or digest in index["posted"].values():
+        return
+    if any(s.get("image_hash") == digest for s in load_json(SCHEDULES_FILE)):
+        return
     try:
-        if os.path.exists(cand):
-            with open(cand, "rb") as f:
-                if _sha256_of_bytes(f.read()) == data_hash:
-                    return filename
-    except Exception:
+        os.remove(_blob_path(digest))
+    except OSError:
         pass
+    invalidate_derived(digest)
+
+
+def _find_file_by_hash(filename: str, data_hash: str, index: dict = None) -> str:
+    """If a media entry with same base name or variant exists and has same hash, return its name; else return empty string."""
+    media = (index or load_media_index())["media"]
+    base, ext = os.path.splitext(filename)
+    # Check exact name first
+    if media.get(filename) == data_hash:
+        return filename
     # Check variants like base_1.ext, base_2.ext
     i = 1
     while True:
         cand_name = f"{base}_{i}{ext}"
-        cand = os.path.join(MEDIA_FOLDER, cand_name)
-        if not os.path.exists(cand):
+        if cand_name not in media:
             break
-        try:
-            with open(cand, "rb") as f:
-                if _sha256_of_bytes(f.read()) == data_hash:
-                    return cand_name
-        except Exception:
-            pass
+        if media[cand_name] == data_hash:
+            return cand_name
         i += 1
     return ""
 
 
+def _assign_media_name(index: dict, filename: str, data_hash: str):
+    """Pick the media name for content in an already loaded index.
+
+    Identical content under the same name (or one of its _N variants) is reused;
+    otherwise a unique name is added. Returns (name, is_new).
+    """
+    existing = _find_file_by_hash(filename, data_hash, index)
+    if existing:
+        return existing, False
+    name = _unique_name(filename, index["media"])
+    index["media"][name] = data_hash
+    return name, True
+
+
+def store_media(filename: str, contents: bytes) -> str:
+    """Add uploaded bytes to the media library and return the media name to use.
+    The bytes themselves are stored only once."""
+    data_hash = put_blob_bytes(contents)
+    index = load_media_index()
+    name, is_new = _assign_media_name(index, filename, data_hash)
+    if is_new:
+        save_media_index(index)
+    return name
+
+
 def mark_posted_entry(filename: str, caption: str = "") -> bool:
-    """Helper to record a posted (file,caption) pair and move the file from
-    MEDIA_FOLDER to MARK_POSTED_FOLDER if it exists.
+    """Helper to record a posted (file,caption) pair and move the media entry
+    to the posted section of the media index if it exists.
 
-    Prevents duplicates by checking both posted.json and mark-posted folder.
-    Returns True if the file was moved or the entry was recorded, False on error.
+    Prevents duplicates by checking both posted.json and the posted entries.
+    Returns True if the entry was moved or recorded, False on error.
     """
     try:
         caption = (caption or "").strip()
         posted_pairs = load_posted_pairs()
-        
+
         # Check if entry already exists in posted.json (prevent duplicate entries)
         exists_in_json = any(
             (p.get("file") == filename) and ((p.get("caption") or "").strip() == caption)
             for p in posted_pairs
         )
-        
-        # Check if file already exists in mark-posted folder (prevent duplicate files)
-        os.makedirs(MARK_POSTED_FOLDER, exist_ok=True)
-        dst_path = os.path.join(MARK_POSTED_FOLDER, filename)
-        exists_in_folder = os.path.exists(dst_path)
-        
-        # If already exists in both places, skip (prevent duplicate)
-        if exists_in_json and exists_in_folder:
-            logging.info(f"Entry dan file sudah ada di mark-posted: {filename} | '{caption}' - melewati")
-            return True
-        
-        # If exists in JSON but not in folder, add to JSON only (file might have been manually moved)
-        if exists_in_json and not exists_in_folder:
-            logging.info(f"Entry sudah ada di posted.json tapi file belum dipindah: {filename} | '{caption}'")
-            # Try to move file if it exists in media folder
-            src = os.path.join(MEDIA_FOLDER, filename)
-            if os.path.exists(src):
-                try:
-                    os.replace(src, dst_path)
-                    logging.info(f"File {filename} berhasil dipindahkan ke mark-posted")
-                except Exception as e:
-                    logging.error(f"Gagal memindahkan file {filename} ke mark-posted: {e}")
-            return True
-        
-        # If not in JSON, add it
         if not exists_in_json:
             posted_pairs.append({"file": filename, "caption": caption})
             save_posted_pairs(posted_pairs)
             logging.info(f"Entry baru ditambahkan ke posted.json: {filename} | '{caption}'")
 
-        # Move file from media to mark-posted folder if exists and not already moved
-        try:
-            src = os.path.join(MEDIA_FOLDER, filename)
-            if os.path.exists(src) and not exists_in_folder:
-                # If destination exists (shouldn't happen, but just in case), rename with timestamp
-                if os.path.exists(dst_path):
-                    base, ext = os.path.splitext(filename)
-                    dst_path = os.path.join(MARK_POSTED_FOLDER, f"{base}_{int(time.time())}{ext}")
-                    logging.warning(f"File {filename} sudah ada di mark-posted, menggunakan nama baru: {os.path.basename(dst_path)}")
-                os.replace(src, dst_path)
-                logging.info(f"File {filename} berhasil dipindahkan ke mark-posted")
-            elif not os.path.exists(src) and exists_in_folder:
-                # File already in mark-posted, that's fine
-                logging.info(f"File {filename} sudah ada di mark-posted folder")
-            elif not os.path.exists(src) and not exists_in_folder:
-                # File doesn't exist in either place - might have been deleted
-                logging.warning(f"File {filename} tidak ditemukan di media atau mark-posted folder")
-        except Exception as e:
-            logging.error(f"Gagal memindahkan file ke mark-posted: {e}")
-            return False
-            
+        # Moving to posted is only an index update; the blob stays where it is
+        index = load_media_index()
+        digest = index["media"].pop(filename, None)
+        if digest:
+            posted_name = filename
+            if index["posted"].get(posted_name, digest) != digest:
+                base, ext = os.path.splitext(filename)
+                posted_name = f"{base}_{int(time.time())}{ext}"
+                logging.warning(f"File {filename} sudah ada di mark-posted, menggunakan nama baru: {posted_name}")
+            index["posted"][posted_name] = digest
+            save_media_index(index)
+            if digest not in index["media"].values():
+                invalidate_thumbnail(digest)
+            logging.info(f"File {filename} berhasil dipindahkan ke mark-posted")
+        elif filename in index["posted"]:
+            logging.info(f"File {filename} sudah ada di mark-posted")
+        else:
+            # File doesn't exist in either place - might have been deleted
+            logging.warning(f"File {filename} tidak ditemukan di media atau mark-posted")
         return True
     except Exception as e:
         logging.error(f"Gagal menandai posted: {e}")
         return False
 
+# ----- Thumbnails -----
+def _get_image_pool() -> ProcessPoolExecutor:
+    """Lazily create the process pool used for CPU-heavy image work."""
+    global _image_pool
+    if _image_pool is None:
+        _image_pool = ProcessPoolExecutor(max_workers=max(1, (os.cpu_count() or 2) // 2))
+    return _image_pool
+
+
+def _render_thumbnail(src_path: str, dst_path: str, size: int, fmt: str) -> int:
+    """Runs in a worker process: resize src into dst and return the thumbnail size in bytes."""
+    with Image.open(src_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        if fmt == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
+        elif fmt == "WEBP" and img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA")
+        tmp_path = f"{dst_path}.tmp"
+        img.save(tmp_path, fmt, quality=80)
+    os.replace(tmp_path, dst_path)
+    return os.path.getsize(dst_path)
+
+
+def _load_disk_lru(folder: str) -> OrderedDict:
+    """Build the LRU index of a cache folder (thumbs/, optimized/), oldest (by mtime) first."""
+    lru = _disk_lrus.get(folder)
+    if lru is None:
+        entries = []
+        for name in os.listdir(folder):
+            path = os.path.join(folder, name)
+            if name.endswith(".tmp") or not os.path.isfile(path):
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, name, st.st_size))
+        entries.sort()
+        lru = _disk_lrus[folder] = OrderedDict((name, size) for _, name, size in entries)
+    return lru
+
+
+def _touch_cached_file(folder: str, name: str, size: int, max_bytes: int):
+    """Mark a cached file as most recently used and evict the oldest ones over the size cap."""
+    lru = _load_disk_lru(folder)
+    lru[name] = size
+    lru.move_to_end(name)
+    try:
+        os.utime(os.path.join(folder, name))
+    except OSError:
+        pass
+    total = sum(lru.values())
+    while total > max_bytes and len(lru) > 1:
+        old_name, old_size = lru.popitem(last=False)
+        total -= old_size
+        try:
+            os.remove(os.path.join(folder, old_name))
+        except OSError:
+            pass
+
+
+def _drop_cached_files(folder: str, digest: str):
+    lru = _load_disk_lru(folder)
+    for name in [n for n in lru if n.startswith(digest)]:
+        lru.pop(name, None)
+        try:
+            os.remove(os.path.join(folder, name))
+        except OSError:
+            pass
+
+
+def invalidate_thumbnail(digest: str):
+    """Drop cached thumbnails for a blob (e.g. after its media entry moved to mark-posted)."""
+    _drop_cached_files(THUMBS_FOLDER, digest)
+
+
+def invalidate_derived(digest: str):
+    """Drop everything rendered from a blob (thumbnails, send-ready variant, skip marker)."""
+    _drop_cached_files(THUMBS_FOLDER, digest)
+    _drop_cached_files(OPTIMIZED_FOLDER, digest)
+
+
+async def _run_image_job(key: str, fn, *args):
+    """Run fn in the image process pool, sharing one execution between concurrent callers of the same key."""
+    pending = _image_jobs_inflight.get(key)
+    if pending is None:
+        loop = asyncio.get_running_loop()
+        pending = asyncio.ensure_future(loop.run_in_executor(_get_image_pool(), fn, *args))
+        _image_jobs_inflight[key] = pending
+        pending.add_done_callback(lambda _: _image_jobs_inflight.pop(key, None))
+    return await asyncio.shield(pending)
+
+
+async def get_thumbnail(digest: str, fmt: str) -> str:
+    """Return the path of a cached thumbnail for a blob, rendering it if needed."""
+    src_path = _blob_path(digest)
+    ext = "webp" if fmt == "WEBP" else "jpg"
+    name = f"{digest}_{THUMB_SIZE}.{ext}"
+    dst_path = os.path.join(THUMBS_FOLDER, name)
+
+    if os.path.exists(dst_path):
+        _touch_cached_file(THUMBS_FOLDER, name, os.path.getsize(dst_path), THUMB_CACHE_MAX_BYTES)
+        return dst_path
+
+    # Several tiles may ask for the same thumbnail at once; render it only once
+    size = await _run_image_job(dst_path, _render_thumbnail, src_path, dst_path, THUMB_SIZE, fmt)
+    _touch_cached_file(THUMBS_FOLDER, name, size, THUMB_CACHE_MAX_BYTES)
+    return dst_path
+
+# ----- Send-ready images -----
+def _optimize_for_send(src_path: str, dst_path: str) -> bool:
+    """Runs in a worker process: write a resized, recompressed, metadata-free JPEG of src
+    into dst. Returns False when the source should be sent untouched: animated, extreme
+    aspect ratio, or (for any format) no resize needed and the JPEG is not smaller."""
+    with Image.open(src_path) as img:
+        # Animated images would lose their frames; send those as they are
+        if getattr(img, "is_animated", False):
+            return False
+        img = ImageOps.exif_transpose(img)
+        w, h = img.size
+        if max(w, h) / max(1, min(w, h)) > 20:
+            return False
+        img.thumbnail((TELEGRAM_PHOTO_MAX_SIDE, TELEGRAM_PHOTO_MAX_SIDE))
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        elif img.mode != "RGB":
+            img = img.convert("RGB")
+        tmp_path = f"{dst_path}.tmp"
+        # Saving without exif=/icc_profile= strips the source metadata
+        img.save(tmp_path, "JPEG", quality=85, optimize=True, progressive=True)
+
+    src_size = os.path.getsize(src_path)
+    dst_size = os.path.getsize(tmp_path)
+    if dst_size > TELEGRAM_PHOTO_MAX_BYTES or (dst_size >= src_size and max(w, h) <= TELEGRAM_PHOTO_MAX_SIDE):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, dst_path)
+    return True
+
+
+async def get_send_ready_path(digest: str, name: str) -> str:
+    """Return the path of the send-ready variant of a blob, or the blob itself when
+    optimization is disabled, unavailable, or not worthwhile. Variants are cached by
+    source sha256 in OPTIMIZED_FOLDER, capped at OPTIMIZED_CACHE_MAX_BYTES (LRU)."""
+    src_path = _blob_path(digest)
+    if not OPTIMIZE_IMAGES or Image is None or not name.lower().endswith(IMAGE_EXTENSIONS):
+        return src_path
+    try:
+        dst_path = os.path.join(OPTIMIZED_FOLDER, f"{digest}.jpg")
+        skip_marker = os.path.join(OPTIMIZED_FOLDER, f"{digest}.skip")
+        if os.path.exists(dst_path):
+            _touch_cached_file(OPTIMIZED_FOLDER, f"{digest}.jpg", os.path.getsize(dst_path), OPTIMIZED_CACHE_MAX_BYTES)
+            return dst_path
+        if os.path.exists(skip_marker):
+            return src_path
+        if await _run_image_job(dst_path, _optimize_for_send, src_path, dst_path):
+            _touch_cached_file(OPTIMIZED_FOLDER, f"{digest}.jpg", os.path.getsize(dst_path), OPTIMIZED_CACHE_MAX_BYTES)
+            return dst_path
+        # Remember that this source is best sent as-is
+        open(skip_marker, "w").close()
+        _touch_cached_file(OPTIMIZED_FOLDER, f"{digest}.skip", 0, OPTIMIZED_CACHE_MAX_BYTES)
+    except Exception as e:
+        logging.error(f"Gagal optimasi gambar {name}: {e}")
+    return src_path
+
+
+async def load_send_ready(digest: str, name: str) -> BytesIO:
+    """Read the send-ready bytes of a blob into a named buffer for client.send_file."""
+    send_path = await get_send_ready_path(digest, name)
+    with open(send_path, "rb") as fobj:
+        bio = BytesIO(fobj.read())
+    bio.name = f"{os.path.splitext(name)[0]}.jpg" if send_path != _blob_path(digest) else name
+    return bio
+
+# ----- Session Store -----
+# All account and bot sessions live in one SQLite database (SESSION_DB_FILE)
+# instead of one .session file each. Entity-cache writes are buffered and
+# flushed in a single transaction when Telethon saves or closes the session.
+class SessionStore:
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                name TEXT PRIMARY KEY,
+                dc_id INTEGER,
+                server_address TEXT,
+                port INTEGER,
+                auth_key BLOB,
+                takeout_id INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS entities (
+                name TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                hash INTEGER NOT NULL,
+                username TEXT,
+                phone INTEGER,
+                entity_name TEXT,
+                date INTEGER,
+                PRIMARY KEY (name, id)
+            );
+            CREATE INDEX IF NOT EXISTS entities_username ON entities (name, username);
+            CREATE INDEX IF NOT EXISTS entities_phone ON entities (name, phone);
+            CREATE TABLE IF NOT EXISTS update_state (
+                name TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                pts INTEGER,
+                qts INTEGER,
+                date INTEGER,
+                seq INTEGER,
+                PRIMARY KEY (name, id)
+            );
+        """)
+        self.conn.commit()
+
+    def exists(self, name: str) -> bool:
+        row = self.conn.execute("SELECT auth_key FROM sessions WHERE name = ?", (name,)).fetchone()
+        return bool(row and row[0])
+
+    def close(self):
+        self.conn.close()
+
+
+class StoredSession(MemorySession):
+    """Telethon session backed by a shared SessionStore."""
+    def __init__(self, store: SessionStore, name: str):
+        super().__init__()
+        self._store = store
+        self._name = name
+        self._pending_entities = {}
+        self._pending_states = {}
+        row = store.conn.execute(
+            "SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions WHERE name = ?", (name,)
+        ).fetchone()
+        if row:
+            self._dc_id, self._server_address, self._port, key, self._takeout_id = row
+            self._auth_key = AuthKey(data=key) if key else None
+
+    def _write_session_row(self):
+        self._store.conn.execute(
+            "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+            (self._name, self._dc_id, self._server_address, self._port,
+             self._auth_key.key if self._auth_key else b"", self._takeout_id),
+        )
+        self._store.conn.commit()
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._write_session_row()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._write_session_row()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._write_session_row()
+
+    def get_update_state(self, entity_id):
+        if entity_id in self._pending_states:
+            return self._pending_states[entity_id]
+        row = self._store.conn.execute(
+            "SELECT pts, qts, date, seq FROM update_state WHERE name = ? AND id = ?", (self._name, entity_id)
+        ).fetchone()
+        if row:
+            pts, qts, date, seq = row
+            date = datetime.fromtimestamp(date, tz=timezone.utc)
+            return types.updates.State(pts, qts, date, seq, unread_count=0)
+
+    def set_update_state(self, entity_id, state):
+        self._pending_states[entity_id] = state
+
+    def get_update_states(self):
+        rows = self._store.conn.execute(
+            "SELECT id, pts, qts, date, seq FROM update_state WHERE name = ?", (self._name,)
+        ).fetchall()
+        states = {
+            entity_id: types.updates.State(pts, qts, datetime.fromtimestamp(date, tz=timezone.utc), seq, unread_count=0)
+            for entity_id, pts, qts, date, seq in rows
+        }
+        states.update(self._pending_states)
+        return states.items()
+
+    def process_entities(self, tlo):
+        for row in self._entities_to_rows(tlo):
+            self._pending_entities[row[0]] = row
+
+    def save(self):
+        """Flush buffered entity and update-state writes in one transaction."""
+        if not self._pending_entities and not self._pending_states:
+            return
+        now = int(time.time())
+        with self._store.conn:
+            self._store.conn.executemany(
+                "INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self._name, *row, now) for row in self._pending_entities.values()],
+            )
+            self._store.conn.executemany(
+                "INSERT OR REPLACE INTO update_state VALUES (?, ?, ?, ?, ?, ?)",
+                [(self._name, entity_id, s.pts, s.qts, int(s.date.timestamp()), s.seq)
+                 for entity_id, s in self._pending_states.items()],
+            )
+        self._pending_entities.clear()
+        self._pending_states.clear()
+
+    def close(self):
+        self.save()
+
+    def delete(self):
+        self._pending_entities.clear()
+        self._pending_states.clear()
+        with self._store.conn:
+            for table in ("sessions", "entities", "update_state"):
+                self._store.conn.execute(f"DELETE FROM {table} WHERE name = ?", (self._name,))
+
+    def _pending_match(self, index: int, value):
+        for row in self._pending_entities.values():
+            if row[index] == value:
+                return row[0], row[1]
+        return None
+
+    def _select_entity(self, where: str, params: tuple):
+        return self._store.conn.execute(
+            f"SELECT id, hash FROM entities WHERE name = ? AND {where} ORDER BY date DESC LIMIT 1",
+            (self._name, *params),
+        ).fetchone()
+
+    def get_entity_rows_by_phone(self, phone):
+        return self._pending_match(3, phone) or self._select_entity("phone = ?", (phone,))
+
+    def get_entity_rows_by_username(self, username):
+        return self._pending_match(2, username) or self._select_entity("username = ?", (username,))
+
+    def get_entity_rows_by_name(self, name):
+        return self._pending_match(4, name) or self._select_entity("entity_name = ?", (name,))
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            ids = (id,)
+        else:
+            ids = (
+                utils.get_peer_id(types.PeerUser(id)),
+                utils.get_peer_id(types.PeerChat(id)),
+                utils.get_peer_id(types.PeerChannel(id)),
+            )
+        for entity_id in ids:
+            if entity_id in self._pending_entities:
+                row = self._pending_entities[entity_id]
+                return row[0], row[1]
+        return self._select_entity(f"id IN ({', '.join('?' * len(ids))})", ids)
+
+
+def get_session_store() -> SessionStore:
+    global session_store
+    if session_store is None:
+        os.makedirs(SESSIONS_FOLDER, exist_ok=True)
+        session_store = SessionStore(SESSION_DB_FILE)
+    return session_store
+
+
+def open_session(name: str):
+    """Session argument for TelegramClient under the configured SESSION_BACKEND."""
+    if SESSION_BACKEND == "store":
+        return StoredSession(get_session_store(), name)
+    os.makedirs(SESSIONS_FOLDER, exist_ok=True)
+    return os.path.join(SESSIONS_FOLDER, f"{name}.session")
+
+
+def session_exists(name: str) -> bool:
+    if SESSION_BACKEND == "store":
+        return get_session_store().exists(name)
+    return os.path.exists(os.path.join(SESSIONS_FOLDER, f"{name}.session"))
+
+
+def migrate_session_files():
+    """One-time import of sessions/*.session files into the session store.
+    Imported files are renamed to *.session.migrated so they are kept as a backup."""
+    if SESSION_BACKEND != "store" or not os.path.isdir(SESSIONS_FOLDER):
+        return
+    store = get_session_store()
+    for fname in sorted(os.listdir(SESSIONS_FOLDER)):
+        if not fname.endswith(".session"):
+            continue
+        name = fname[:-len(".session")]
+        path = os.path.join(SESSIONS_FOLDER, fname)
+        if store.exists(name):
+            continue
+        try:
+            src = sqlite3.connect(path)
+            try:
+                row = src.execute("SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchone()
+                entities = src.execute("SELECT id, hash, username, phone, name, date FROM entities").fetchall()
+                try:
+                    states = src.execute("SELECT id, pts, qts, date, seq FROM update_state").fetchall()
+                except sqlite3.Error:
+                    states = []
+            finally:
+                src.close()
+            if not row:
+                continue
+            with store.conn:
+                store.conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)", (name, *row))
+                store.conn.executemany("INSERT OR REPLACE INTO entities VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       [(name, *e) for e in entities])
+                store.conn.executemany("INSERT OR REPLACE INTO update_state VALUES (?, ?, ?, ?, ?, ?)",
+                                       [(name, *st) for st in states])
+            os.replace(path, f"{path}.migrated")
+            logging.info(f"Session {name} dimigrasi ke {SESSION_DB_FILE}")
+        except Exception as e:
+            logging.error(f"Gagal migrasi session {fname}: {e}")
+
 # ----- Telegram Client -----
 async def start_client(account):
-    os.makedirs(SESSIONS_FOLDER, exist_ok=True)
-    session_path = os.path.join(SESSIONS_FOLDER, f"{account['id']}.session")
-    client = TelegramClient(session_path, account['api_id'], account['api_hash'])
+    client = TelegramClient(open_session(account['id']), account['api_id'], account['api_hash'])
     await client.connect()
     if not await client.is_user_authorized():
         await client.disconnect()
@@ -352,43 +1126,133 @@ async def start_client(account):
 async def load_clients():
     global clients
     accounts = load_accounts()
+    migrate_session_files()
     for c in clients.values():
         try: await c.disconnect()
         except Exception: pass
     clients = {}
     for acc in accounts:
-        session_path = os.path.join(SESSIONS_FOLDER, f"{acc['id']}.session")
-        if os.path.exists(session_path):
+        if session_exists(acc['id']):
             try:
                 client = await start_client(acc)
                 if client: clients[acc['id']] = client
             except Exception as e:
                 logging.error(f"Gagal load client {acc['id']}: {e}")
 
+# ----- RPC Dispatch -----
+class FloodWaitActive(Exception):
+    """Raised without touching Telegram while an account's flood wait is still running."""
+    def __init__(self, seconds: int):
+        super().__init__(f"Flood wait {seconds} detik")
+        self.seconds = seconds
+
+
+class AccountDispatcher:
+    """Per-account queue for Telegram RPCs.
+
+    Limits the account to ACCOUNT_RPC_CONCURRENCY calls at a time and remembers
+    the deadline of the last FloodWaitError. Queued work waits out short flood
+    waits; longer ones fail fast with FloodWaitActive instead of calling Telegram.
+    """
+    def __init__(self, account_id: str):
+        self.account_id = account_id
+        self.semaphore = asyncio.Semaphore(ACCOUNT_RPC_CONCURRENCY)
+        self.flood_until = 0.0
+        self.queued = 0
+        self.running = 0
+
+    def is_idle(self) -> bool:
+        """True when a call would run right away: no flood wait and a free slot."""
+        return not self.flood_remaining() and not self.semaphore.locked()
+
+    def flood_remaining(self) -> int:
+        return max(0, int(self.flood_until - time.time() + 0.999))
+
+    async def run(self, fn, *args, **kwargs):
+        self.queued += 1
+        acquired = False
+        try:
+            async with self.semaphore:
+                self.queued -= 1
+                acquired = True
+                self.running += 1
+                try:
+                    remaining = self.flood_remaining()
+                    if remaining > FLOOD_HOLD_MAX_SECONDS:
+                        raise FloodWaitActive(remaining)
+                    if remaining:
+                        logging.info(f"Akun {self.account_id} menunggu flood wait {remaining} detik")
+                        await asyncio.sleep(remaining)
+                    try:
+                        return await fn(*args, **kwargs)
+                    except errors.FloodWaitError as e:
+                        self.flood_until = max(self.flood_until, time.time() + e.seconds)
+                        logging.warning(f"Akun {self.account_id} kena flood wait {e.seconds} detik")
+                        raise
+                finally:
+                    self.running -= 1
+        finally:
+            if not acquired:
+                self.queued -= 1
+
+    def status(self) -> dict:
+        return {
+            "queue_depth": self.queued,
+            "in_flight": self.running,
+            "flood_wait_until": self.flood_until if self.flood_remaining() else None,
+            "flood_wait_seconds": self.flood_remaining(),
+        }
+
+
+def get_dispatcher(account_id: str) -> AccountDispatcher:
+    dispatcher = dispatchers.get(account_id)
+    if dispatcher is None:
+        dispatcher = dispatchers[account_id] = AccountDispatcher(account_id)
+    return dispatcher
+
+
+def _flood_http_error(seconds: int) -> HTTPException:
+    return HTTPException(status_code=429, detail=f"Flood wait {seconds} detik", headers={"Retry-After": str(seconds)})
+
 # ----- Accounts API -----
 @app.get("/accounts/")
 async def get_accounts():
     accounts = load_accounts()
-    result = []
-    for acc in accounts:
+
+    async def fetch_me(acc):
         client = clients.get(acc['id'])
-        username = first_name = last_name = None
-        if client:
-            try:
-                me = await client.get_me()
-                username = me.username
-                first_name = me.first_name
-                last_name = me.last_name
-            except Exception: pass
+        dispatcher = get_dispatcher(acc['id'])
+        # Don't let a read-only listing wait on a flood wait or a running upload;
+        # show the last known profile instead
+        if not client or not dispatcher.is_idle():
+            return account_profiles.get(acc['id'])
+        try:
+            me = await dispatcher.run(client.get_me)
+        except Exception:
+            return account_profiles.get(acc['id'])
+        if me:
+            account_profiles[acc['id']] = me
+        return me
+
+    # Each account goes through its own queue, so accounts are queried concurrently
+    profiles = await asyncio.gather(*(fetch_me(acc) for acc in accounts))
+    result = []
+    for acc, me in zip(accounts, profiles):
         result.append({
             "id": acc["id"],
             "phone": acc["phone"],
-            "username": username,
-            "first_name": first_name,
-            "last_name": last_name
+            "username": me.username if me else None,
+            "first_name": me.first_name if me else None,
+            "last_name": me.last_name if me else None,
+            "dispatch": get_dispatcher(acc["id"]).status()
         })
     return result
 
+@app.get("/dispatch-status/")
+async def dispatch_status():
+    """Queue depth and flood-wait deadline per account"""
+    return {acc["id"]: get_dispatcher(acc["id"]).status() for acc in load_accounts()}
+
 # ----- OTP / Add Account -----
 @app.post("/add-account-otp/")
 async def add_account_otp(data: dict):
@@ -409,7 +1273,7 @@ async def add_account_otp(data: dict):
     accounts.append({"id": account_id, "phone": phone, "api_id": api_id, "api_hash": api_hash})
     save_accounts(accounts)
 
-    client = TelegramClient(os.path.join(SESSIONS_FOLDER, f"{account_id}.session"), api_id, api_hash)
+    client = TelegramClient(open_session(account_id), api_id, api_hash)
     try:
         await client.connect()
         await client.send_code_request(phone)
@@ -440,20 +1304,54 @@ async def verify_otp(account_id: str = Form(...), code: str = Form(...), passwor
 @app.get("/media-list")
 async def media_list():
     posted_pairs = load_posted_pairs()
-    os.makedirs(MEDIA_FOLDER, exist_ok=True)
-    files = [f for f in os.listdir(MEDIA_FOLDER) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp'))]
+    if inbox_has_images() and not any(
+        j["type"] == "sync_media_inbox" and j["status"] in ("queued", "running") for j in jobs.values()
+    ):
+        # Ingest hand-dropped images in the background; they show up on a later refresh
+        submit_job("sync_media_inbox", {})
+    media = load_media_index()["media"]
+    files = [f for f in media if f.lower().endswith(IMAGE_EXTENSIONS)]
     captions = load_captions() or [""]
 
     import itertools
     available_pairs = list(itertools.product(files, captions))
     random.shuffle(available_pairs)
 
+    # Version thumbnail URLs by content hash so they can be cached as immutable
+    thumb_urls = {fname: f"/thumbs/{quote(fname)}?v={media[fname][:12]}" for fname in files}
+
     result = []
     for fname, cap in available_pairs:
         if {"file": fname, "caption": cap} not in posted_pairs:
-            result.append({"file": fname, "caption": cap})
+            result.append({"file": fname, "caption": cap, "thumbnail": thumb_urls[fname]})
     return result
 
+@app.get("/thumbs/{file}")
+async def thumbnail(file: str, request: Request):
+    """Serve a resized thumbnail of a media file, generated lazily and cached on disk."""
+    if os.path.basename(file) != file or not file.lower().endswith(IMAGE_EXTENSIONS):
+        raise HTTPException(status_code=400, detail="Nama file tidak valid")
+    digest = load_media_index()["media"].get(file)
+    src_path = _blob_path(digest) if digest else ""
+    if not src_path or not os.path.isfile(src_path):
+        raise HTTPException(status_code=404, detail="File media tidak ditemukan")
+
+    if Image is None:
+        # Pillow not installed: serve the original without long-lived caching
+        return FileResponse(src_path, media_type=mimetypes.guess_type(file)[0], headers={"Cache-Control": "no-cache"})
+
+    fmt = "WEBP" if "image/webp" in request.headers.get("accept", "") else "JPEG"
+    try:
+        thumb_path = await get_thumbnail(digest, fmt)
+    except Exception as e:
+        logging.error(f"Gagal membuat thumbnail {file}: {e}")
+        return FileResponse(src_path, media_type=mimetypes.guess_type(file)[0], headers={"Cache-Control": "no-cache"})
+    return FileResponse(
+        thumb_path,
+        media_type="image/webp" if fmt == "WEBP" else "image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "Vary": "Accept"},
+    )
+
 @app.get("/captions-list")
 async def captions_list():
     return load_captions()
@@ -471,29 +1369,77 @@ async def mark_posted_file_json(data: dict):
 # Endpoint: upload media files (images)
 @app.post("/upload-media/")
 async def upload_media(file: UploadFile = File(...)):
-    os.makedirs(MEDIA_FOLDER, exist_ok=True)
-    filename = file.filename
-    dest_path = os.path.join(MEDIA_FOLDER, filename)
+    filename = os.path.basename(file.filename)
     try:
         contents = await file.read()
-        # If an identical file already exists in media (by hash), reuse it and don't create a duplicate
-        data_hash = _sha256_of_bytes(contents)
-        existing = _find_file_by_hash(filename, data_hash)
-        if existing:
-            return {"status": "ok", "filename": existing}
-
-        # If filename exists but different content, find a unique filename
-        if os.path.exists(dest_path):
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(os.path.join(MEDIA_FOLDER, f"{base}_{counter}{ext}")):
-                counter += 1
-            dest_path = os.path.join(MEDIA_FOLDER, f"{base}_{counter}{ext}")
-        with open(dest_path, "wb") as f:
-            f.write(contents)
+        # Identical content reuses the existing entry; bytes are stored only once
+        stored_name = store_media(filename, contents)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gagal upload media: {e}")
-    return {"status": "ok", "filename": os.path.basename(dest_path)}
+    return {"status": "ok", "filename": stored_name}
+
+
+def _spool_and_hash(src, tmp_dir: str):
+    """Copy an uploaded part into a temp file inside the blob store, hashing it in the
+    same pass. Returns (tmp_path, sha256); the temp file is removed on failure."""
+    h = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            src.seek(0)
+            for chunk in iter(lambda: src.read(UPLOAD_CHUNK_SIZE), b""):
+                h.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path, h.hexdigest()
+
+
+# Endpoint: upload many media files in one request
+@app.post("/upload-media-batch/")
+async def upload_media_batch(files: List[UploadFile] = File(...)):
+    """Store many images at once. Parts are copied into the blob store and hashed in
+    the same pass on the thread pool, deduplicated against the media index and saved
+    with one index write."""
+    tmp_dir = os.path.join(BLOBS_FOLDER, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    parts = []
+    results = []
+    for file in files:
+        name = os.path.basename(file.filename or "")
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            results.append({"file": file.filename, "status": "error", "detail": "Bukan file gambar"})
+            continue
+        parts.append((name, file))
+
+    loop = asyncio.get_running_loop()
+    spooled = await asyncio.gather(
+        *(loop.run_in_executor(None, _spool_and_hash, file.file, tmp_dir) for _, file in parts),
+        return_exceptions=True,
+    )
+
+    index = load_media_index()
+    changed = False
+    for (name, _), spool in zip(parts, spooled):
+        tmp_path = None
+        try:
+            if isinstance(spool, Exception):
+                raise spool
+            tmp_path, digest = spool
+            put_blob_file(tmp_path, digest)
+            stored_name, is_new = _assign_media_name(index, name, digest)
+            changed = changed or is_new
+            results.append({"file": name, "status": "ok" if is_new else "duplicate", "filename": stored_name})
+        except Exception as e:
+            if tmp_path and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            results.append({"file": name, "status": "error", "detail": f"Gagal upload media: {e}"})
+    if changed:
+        save_media_index(index)
+
+    failed = sum(1 for r in results if r["status"] == "error")
+    return {"status": "ok" if not failed else "partial", "failed": failed, "results": results}
 
 
 # Endpoint: upload captions file (captions.txt)
@@ -530,6 +1476,7 @@ async def join_group(account_id: str = Form(...), group: str = Form(...)):
     client = clients.get(account_id)
     if not client:
         raise HTTPException(status_code=404, detail=f"Akun {account_id} tidak ditemukan")
+    rpc = get_dispatcher(account_id).run
     
     # Bersihkan input (hapus spasi, tangani format URL)
     target = group.strip()
@@ -547,36 +1494,39 @@ async def join_group(account_id: str = Form(...), group: str = Form(...)):
         if "joinchat/" in target or "+" in target:
             invite_hash = target.split("joinchat/")[-1] if "joinchat/" in target else target.replace("+", "")
             try:
-                await client(functions.messages.ImportChatInviteRequest(hash=invite_hash))
+                await rpc(client, functions.messages.ImportChatInviteRequest(hash=invite_hash))
                 return {"status": f"Berhasil bergabung via invite link", "already_member": False}
             except errors.UserAlreadyParticipantError:
                 return {"status": "Sudah menjadi anggota", "already_member": True}
         
         # 2. Jika ini username atau ID
         try:
-            entity = await client.get_entity(target)
+            entity = await rpc(client.get_entity, target)
             
             # Cek apakah sudah member
             try:
-                await client.get_permissions(entity, await client.get_me())
+                await rpc(client.get_permissions, entity, await rpc(client.get_me))
                 return {"status": "Sudah menjadi anggota", "already_member": True}
             except errors.UserNotParticipantError:
                 pass
             
             # Coba join public channel/group
-            await client(functions.channels.JoinChannelRequest(entity))
+            await rpc(client, functions.channels.JoinChannelRequest(entity))
             return {"status": "Berhasil bergabung ke grup", "already_member": False}
+        except (errors.FloodWaitError, FloodWaitActive):
+            # A flood wait is not a sign of a private link; report it as 429
+            raise
         except Exception:
             # Fallback jika get_entity gagal tapi mungkin dia private link tanpa joinchat/
-            await client(functions.messages.ImportChatInviteRequest(hash=target))
+            await rpc(client, functions.messages.ImportChatInviteRequest(hash=target))
             return {"status": "Berhasil bergabung via hash", "already_member": False}
                 
     except errors.InviteHashExpiredError:
         raise HTTPException(status_code=400, detail="Link invite sudah kadaluarsa")
     except errors.InviteHashInvalidError:
         raise HTTPException(status_code=400, detail="Link invite tidak valid")
-    except errors.FloodWaitError as e:
-        raise HTTPException(status_code=429, detail=f"Flood wait {e.seconds} detik")
+    except (errors.FloodWaitError, FloodWaitActive) as e:
+        raise _flood_http_error(e.seconds)
     except Exception as e:
         logging.error(f"Error joining {target} with {account_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Gagal bergabung: {str(e)}")
@@ -595,6 +1545,7 @@ async def post_to_group(
     client = clients.get(account_id)
     if not client:
         raise HTTPException(status_code=404, detail=f"Akun {account_id} tidak ditemukan")
+    rpc = get_dispatcher(account_id).run
 
     try:
         if random_post:
@@ -602,45 +1553,22 @@ async def post_to_group(
             if not media_items:
                 raise HTTPException(status_code=404, detail="Tidak ada media tersedia")
             selected = random.choice(media_items)
-            file_path = os.path.join(MEDIA_FOLDER, selected['file'])
-            contents = open(file_path, "rb").read()
-            bio = BytesIO(contents)
-            bio.name = selected['file']
-            await client.send_file(group, bio, caption=selected['caption'])
+            digest = load_media_index()["media"][selected['file']]
+            bio = await load_send_ready(digest, selected['file'])
+            await rpc(client.send_file, group, bio, caption=selected['caption'])
             # Mark and move the posted file only if mark_posted is True
             if mark_posted:
                 mark_posted_entry(selected['file'], selected.get('caption', ""))
         else:
             if file:
-                # Persist uploaded file to media folder first so we can mark/move it
-                os.makedirs(MEDIA_FOLDER, exist_ok=True)
-                upload_name = file.filename
-                dest_path = os.path.join(MEDIA_FOLDER, upload_name)
+                # Persist uploaded file to the media store first so we can mark/move it
                 contents = await file.read()
-
-                # If an identical file already exists in media (by hash), reuse it
+                upload_name = store_media(os.path.basename(file.filename), contents)
                 data_hash = _sha256_of_bytes(contents)
-                existing = _find_file_by_hash(upload_name, data_hash)
-                if existing:
-                    upload_name = existing
-                    dest_path = os.path.join(MEDIA_FOLDER, upload_name)
-                else:
-                    # If filename exists but different content, find a unique filename
-                    if os.path.exists(dest_path):
-                        base, ext = os.path.splitext(upload_name)
-                        counter = 1
-                        while os.path.exists(os.path.join(MEDIA_FOLDER, f"{base}_{counter}{ext}")):
-                            counter += 1
-                        upload_name = f"{base}_{counter}{ext}"
-                        dest_path = os.path.join(MEDIA_FOLDER, upload_name)
-                    with open(dest_path, "wb") as f:
-                        f.write(contents)
-
-                # Send the saved (or existing) file
-                with open(dest_path, "rb") as fobj:
-                    bio = BytesIO(fobj.read())
-                    bio.name = upload_name
-                    await client.send_file(group, bio, caption=message)
+
+                # Send the stored file, using its send-ready variant if any
+                bio = await load_send_ready(data_hash, upload_name)
+                await rpc(client.send_file, group, bio, caption=message)
 
                 # Mark and move the posted file ONLY if mark_posted is True
                 # This should only be set after successful send to ALL groups
@@ -649,30 +1577,29 @@ async def post_to_group(
             else:
                 if not message.strip():
                     raise HTTPException(status_code=400, detail="Pesan kosong tidak boleh dikirim tanpa gambar")
-                await client.send_message(group, message)
-    except errors.FloodWaitError as e:
-        error_msg = f"Flood wait {e.seconds} detik"
-        log_send_result(account_id, group, False, error_msg)
-        raise HTTPException(status_code=429, detail=error_msg)
+                await rpc(client.send_message, group, message)
+    except (errors.FloodWaitError, FloodWaitActive) as e:
+        log_send_result(account_id, group, False, f"Flood wait {e.seconds} detik", "flood_wait", e.seconds)
+        raise _flood_http_error(e.seconds)
     except errors.UserNotParticipantError:
         # Account is not a member of the target group — return a clear error
         error_msg = "Akun belum bergabung ke grup tujuan / tidak ditemukan di grup"
-        log_send_result(account_id, group, False, error_msg)
+        log_send_result(account_id, group, False, error_msg, "not_participant")
         raise HTTPException(status_code=400, detail=error_msg)
     except errors.ChatWriteForbiddenError:
         # Bot/akun tidak bisa menulis di grup (misal dibatasi oleh admin)
         error_msg = "Akun tidak diizinkan mengirim pesan ke grup (write forbidden)"
-        log_send_result(account_id, group, False, error_msg)
+        log_send_result(account_id, group, False, error_msg, "write_forbidden")
         raise HTTPException(status_code=400, detail=error_msg)
     except errors.ChannelPrivateError:
         error_msg = "Grup/private tidak dapat diakses atau tidak ditemukan"
-        log_send_result(account_id, group, False, error_msg)
+        log_send_result(account_id, group, False, error_msg, "private")
         raise HTTPException(status_code=400, detail=error_msg)
     except Exception as e:
         # For any other telethon / RPC errors, return a safe error message without crashing
         error_msg = f"Error tidak terduga: {str(e)}"
         logging.error(f"Unexpected error posting to group: {e}")
-        log_send_result(account_id, group, False, error_msg)
+        log_send_result(account_id, group, False, error_msg, "unknown")
         raise HTTPException(status_code=500, detail=error_msg)
 
     # Log successful send
@@ -686,17 +1613,23 @@ async def update_name(account_id: str = Form(...), new_first_name: str = Form(..
         raise HTTPException(status_code=400, detail="First name tidak boleh kosong")
     client = clients.get(account_id)
     if not client: raise HTTPException(status_code=404, detail="Akun tidak ditemukan")
-    await client(functions.account.UpdateProfileRequest(first_name=new_first_name.strip(), last_name=new_last_name.strip() or None))
+    try:
+        await get_dispatcher(account_id).run(client, functions.account.UpdateProfileRequest(first_name=new_first_name.strip(), last_name=new_last_name.strip() or None))
+    except (errors.FloodWaitError, FloodWaitActive) as e:
+        raise _flood_http_error(e.seconds)
     return {"status": "Nama berhasil diupdate"}
 
 @app.post("/update-username/")
 async def update_username(account_id: str = Form(...), username: str = Form(...)):
     client = clients.get(account_id)
     if not client: raise HTTPException(status_code=404, detail="Akun tidak ditemukan")
-    me = await client.get_me()
-    if username == me.username: return {"status": "Username sama seperti sebelumnya, tidak diubah"}
+    rpc = get_dispatcher(account_id).run
     try:
-        await client(functions.account.UpdateUsernameRequest(username=username))
+        me = await rpc(client.get_me)
+        if username == me.username: return {"status": "Username sama seperti sebelumnya, tidak diubah"}
+        await rpc(client, functions.account.UpdateUsernameRequest(username=username))
+    except (errors.FloodWaitError, FloodWaitActive) as e:
+        raise _flood_http_error(e.seconds)
     except errors.UsernameOccupiedError:
         raise HTTPException(status_code=400, detail="Username sudah digunakan")
     except Exception as e:
@@ -712,22 +1645,96 @@ async def update_photo(account_id: str = Form(...), photo: UploadFile = File(...
     if ext not in (".jpg", ".jpeg", ".png", ".jfif"): ext = ".jpg"
     bio = BytesIO(contents)
     bio.name = f"profile{ext}"
+    rpc = get_dispatcher(account_id).run
     try:
-        file = await client.upload_file(bio)
-        await client(functions.photos.UploadProfilePhotoRequest(file=file))
+        file = await rpc(client.upload_file, bio)
+        await rpc(client, functions.photos.UploadProfilePhotoRequest(file=file))
+    except (errors.FloodWaitError, FloodWaitActive) as e:
+        raise _flood_http_error(e.seconds)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Gagal update foto: {str(e)}")
     return {"status": "Foto profil berhasil diupdate"}
 
 # ----- Mount Static -----
-app.mount("/media", StaticFiles(directory=MEDIA_FOLDER), name="media")
 app.mount("/captions", StaticFiles(directory=CAPTIONS_FOLDER), name="captions")
-app.mount("/mark-posted", StaticFiles(directory=MARK_POSTED_FOLDER), name="mark-posted")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory=STATIC_FOLDER), name="static")
+
+@app.get("/media/{file}")
+async def media_file(file: str):
+    path = media_blob_path(file, "media")
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File media tidak ditemukan")
+    return FileResponse(path, media_type=mimetypes.guess_type(file)[0])
+
+@app.get("/mark-posted/{file}")
+async def mark_posted_file(file: str):
+    path = media_blob_path(file, "posted")
+    if not path or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="File tidak ditemukan di mark-posted")
+    return FileResponse(path, media_type=mimetypes.guess_type(file)[0])
+
+# ----- Static Assets -----
+def _encode_variants(data: bytes) -> dict:
+    variants = {"identity": data, "gzip": gzip.compress(data, compresslevel=9, mtime=0), "br": None}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data, quality=11)
+    return variants
+
+
+def build_static_assets():
+    """Precompute fingerprinted, compressed copies of static JS/CSS and an index.html
+    that points at them. Called once at startup."""
+    global index_page
+    static_assets.clear()
+    urls = {}
+    for name in sorted(os.listdir(STATIC_FOLDER)):
+        path = os.path.join(STATIC_FOLDER, name)
+        base, ext = os.path.splitext(name)
+        if ext not in FINGERPRINTED_EXTENSIONS or not os.path.isfile(path):
+            continue
+        with open(path, "rb") as f:
+            data = f.read()
+        fingerprinted = f"{base}.{_sha256_of_bytes(data)[:12]}{ext}"
+        entry = _encode_variants(data)
+        entry["media_type"] = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        static_assets[fingerprinted] = entry
+        urls[f"/static/{name}"] = f"/assets/{fingerprinted}"
+
+    with open(os.path.join(STATIC_FOLDER, "index.html"), "r", encoding="utf-8") as f:
+        html = f.read()
+    for old_url, new_url in urls.items():
+        html = html.replace(f'"{old_url}"', f'"{new_url}"')
+    index_page = _encode_variants(html.encode("utf-8"))
+    logging.info(f"{len(static_assets)} static asset disiapkan (brotli: {'ya' if brotli else 'tidak'})")
+
+
+def _negotiated_response(variants: dict, media_type: str, request: Request, cache_control: str) -> Response:
+    accept = request.headers.get("accept-encoding", "")
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    if variants["br"] is not None and "br" in accept:
+        headers["Content-Encoding"] = "br"
+        body = variants["br"]
+    elif "gzip" in accept:
+        headers["Content-Encoding"] = "gzip"
+        body = variants["gzip"]
+    else:
+        body = variants["identity"]
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+@app.get("/assets/{name}")
+async def static_asset(name: str, request: Request):
+    entry = static_assets.get(name)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Asset tidak ditemukan")
+    return _negotiated_response(entry, entry["media_type"], request, "public, max-age=31536000, immutable")
 
 @app.get("/")
-async def root():
-    return FileResponse("static/index.html")
+async def root(request: Request):
+    if not index_page:
+        build_static_assets()
+    # index.html itself must always be revalidated so new fingerprints are picked up
+    return _negotiated_response(index_page, "text/html; charset=utf-8", request, "no-cache")
 
 @app.get("/ping")
 async def ping():
@@ -740,6 +1747,11 @@ async def get_analytics(group_a: str = None, group_b: str = None):
     summary = get_analytics_summary(group_a, group_b)
     return summary
 
+@app.get("/analytics/errors")
+async def get_analytics_errors(since: float = None, until: float = None, account_id: str = None, group: str = None):
+    """Failure breakdown per error code, account and group"""
+    return get_error_breakdown(since, until, account_id, group)
+
 @app.post("/analytics/clear/")
 async def clear_analytics():
     """Clear all analytics data"""
@@ -753,7 +1765,7 @@ async def clear_analytics():
 # ----- SCHEDULE LOGIC -----
 async def run_scheduler():
     logging.info("Scheduler task started")
-    while True:
+    while not shutdown_event.is_set():
         try:
             now = datetime.now()
             current_time = now.strftime("%H:%M")
@@ -763,10 +1775,17 @@ async def run_scheduler():
             changed = False
             
             for s in schedules:
+                if shutdown_event.is_set():
+                    break
                 if s.get("time") == current_time and s.get("last_run") != today_str:
                     # Time to run!
                     logging.info(f"Running schedule: {s.get('id')}")
-                    success = await execute_schedule(s)
+                    planned = datetime.combine(now.date(), datetime.strptime(s["time"], "%H:%M").time()).timestamp()
+                    started = time.time()
+                    run_info = {}
+                    async with track_inflight():
+                        success = await execute_schedule(s, run_info)
+                    record_schedule_run(s.get("id"), planned, started, time.time() - started, success, run_info)
                     
                     if success:
                         s["last_run"] = today_str
@@ -780,36 +1799,226 @@ async def run_scheduler():
         except Exception as e:
             logging.error(f"Error in scheduler: {e}")
             
-        await asyncio.sleep(30) # Check every 30s
+        # Check every 30s, waking up early on shutdown
+        try:
+            await asyncio.wait_for(shutdown_event.wait(), 30)
+        except asyncio.TimeoutError:
+            pass
+    logging.info("Scheduler task stopped")
 
-async def execute_schedule(s):
-    bot_token = s.get("bot_token")
+# ----- Schedule History -----
+def load_schedule_history() -> dict:
+    ensure_file_exists(SCHEDULE_HISTORY_FILE, {})
+    try:
+        with open(SCHEDULE_HISTORY_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            return {}
+    except Exception as e:
+        logging.error(f"Gagal load schedule history {SCHEDULE_HISTORY_FILE}: {e}")
+        return {}
+
+
+def record_schedule_run(sched_id: str, planned: float, started: float, duration: float, success: bool, run_info: dict):
+    """Append a run to the schedule's history, keeping only the last SCHEDULE_HISTORY_LIMIT runs"""
+    try:
+        history = load_schedule_history()
+        runs = history.setdefault(sched_id, [])
+        runs.append({
+            "planned": planned,
+            "started": started,
+            "drift": round(started - planned, 3),
+            "duration": round(duration, 3),
+            "bytes": run_info.get("bytes", 0),
+            "success": success,
+            "error": run_info.get("error", ""),
+        })
+        if len(runs) > SCHEDULE_HISTORY_LIMIT:
+            history[sched_id] = runs[-SCHEDULE_HISTORY_LIMIT:]
+        save_json(SCHEDULE_HISTORY_FILE, history)
+    except Exception as e:
+        logging.error(f"Gagal mencatat riwayat jadwal {sched_id}: {e}")
+
+
+def _percentile(values: List[float], pct: float):
+    """Nearest-rank percentile; None for an empty list."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def get_schedule_stats() -> dict:
+    """Drift and duration percentiles per schedule from the run history"""
+    stats = {}
+    for sched_id, runs in load_schedule_history().items():
+        drifts = [r.get("drift", 0) for r in runs]
+        durations = [r.get("duration", 0) for r in runs]
+        errors_by_class = {}
+        for r in runs:
+            if not r.get("success"):
+                key = r.get("error") or "unknown"
+                errors_by_class[key] = errors_by_class.get(key, 0) + 1
+        stats[sched_id] = {
+            "runs": len(runs),
+            "success": sum(1 for r in runs if r.get("success")),
+            "failed": sum(1 for r in runs if not r.get("success")),
+            "drift_p50": _percentile(drifts, 50),
+            "drift_p95": _percentile(drifts, 95),
+            "duration_p50": _percentile(durations, 50),
+            "duration_p95": _percentile(durations, 95),
+            "bytes_total": sum(r.get("bytes", 0) for r in runs),
+            "errors": errors_by_class,
+            "last_run": runs[-1] if runs else None,
+        }
+    return stats
+
+# ----- Schedule Targets -----
+# Resolved schedule targets are cached per bot session so repeating schedules can
+# send straight to the stored peer without a ResolveUsername round trip.
+STALE_PEER_ERRORS = (
+    errors.ChannelInvalidError,
+    errors.PeerIdInvalidError,
+    errors.ChatIdInvalidError,
+    errors.UserIdInvalidError,
+)
+
+
+def _bot_session_name(bot_token: str) -> str:
+    return f"bot_{hashlib.md5(bot_token.encode()).hexdigest()[:10]}"
+
+
+def _bot_credentials(s: dict):
+    """API ID/Hash for a schedule, falling back to the first account's credentials."""
     api_id = s.get("api_id")
     api_hash = s.get("api_hash")
+    if not api_id or not api_hash:
+        accounts = load_accounts()
+        if accounts:
+            api_id = accounts[0].get("api_id")
+            api_hash = accounts[0].get("api_hash")
+    return api_id, api_hash
+
+
+async def start_bot_client(bot_token: str, api_id, api_hash) -> TelegramClient:
+    client = TelegramClient(open_session(_bot_session_name(bot_token)), int(api_id), api_hash)
+    try:
+        await client.start(bot_token=bot_token)
+    except BaseException:
+        await client.disconnect()
+        raise
+    return client
+
+
+def normalize_target(target: str) -> str:
+    """Canonical form of a target: bare lowercase username, or the numeric ID as-is."""
+    t = (target or "").strip()
+    if "t.me/" in t:
+        t = t.split("t.me/")[-1].strip("/")
+    if t.startswith("@"):
+        t = t[1:]
+    if t.lstrip("-").isdigit():
+        return t
+    return t.lower()
+
+
+def load_target_cache() -> dict:
+    ensure_file_exists(TARGET_CACHE_FILE, {})
+    try:
+        with open(TARGET_CACHE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+            if isinstance(data, dict):
+                return data
+            return {}
+    except Exception as e:
+        logging.error(f"Gagal load target cache {TARGET_CACHE_FILE}: {e}")
+        return {}
+
+
+def _target_cache_key(session_name: str, target: str) -> str:
+    return f"{session_name}|{normalize_target(target)}"
+
+
+def _peer_from_cache(entry: dict):
+    kind = entry.get("type")
+    if kind == "channel":
+        return types.InputPeerChannel(channel_id=entry["id"], access_hash=entry["access_hash"])
+    if kind == "user":
+        return types.InputPeerUser(user_id=entry["id"], access_hash=entry["access_hash"])
+    if kind == "chat":
+        return types.InputPeerChat(chat_id=entry["id"])
+    return None
+
+
+def _peer_to_cache(peer) -> dict:
+    if isinstance(peer, types.InputPeerChannel):
+        return {"type": "channel", "id": peer.channel_id, "access_hash": peer.access_hash}
+    if isinstance(peer, types.InputPeerUser):
+        return {"type": "user", "id": peer.user_id, "access_hash": peer.access_hash}
+    if isinstance(peer, types.InputPeerChat):
+        return {"type": "chat", "id": peer.chat_id, "access_hash": None}
+    return {}
+
+
+async def resolve_schedule_target(client: TelegramClient, session_name: str, target: str, refresh: bool = False):
+    """Return an input peer for target, using the persistent cache unless refresh is set.
+
+    With refresh, the target is resolved over the network (get_entity sends
+    ResolveUsername for usernames and links) rather than from the session's entity
+    cache, which would hand back the same stale access hash."""
+    key = _target_cache_key(session_name, target)
+    cache = load_target_cache()
+    if not refresh and key in cache:
+        peer = _peer_from_cache(cache[key])
+        if peer is not None:
+            return peer
+
+    # Numeric IDs must reach Telethon as ints, or they are parsed as phone numbers
+    lookup = int(target) if target.strip().lstrip("-").isdigit() else target
+    if refresh:
+        peer = utils.get_input_peer(await client.get_entity(lookup))
+    else:
+        peer = await client.get_input_entity(lookup)
+    entry = _peer_to_cache(peer)
+    if entry:
+        entry["resolved_at"] = time.time()
+        cache = load_target_cache()
+        cache[key] = entry
+        save_json(TARGET_CACHE_FILE, cache)
+    return peer
+
+
+def forget_schedule_target(session_name: str, target: str):
+    cache = load_target_cache()
+    if cache.pop(_target_cache_key(session_name, target), None) is not None:
+        save_json(TARGET_CACHE_FILE, cache)
+
+
+async def execute_schedule(s, run_info: dict = None):
+    """Send a schedule via its bot. If run_info is given, it receives the number of
+    bytes uploaded and, on failure, the error class name."""
+    run_info = run_info if run_info is not None else {}
+    bot_token = s.get("bot_token")
     target = s.get("target")
     image_filename = s.get("image_filename")
+    image_hash = s.get("image_hash")
     caption = s.get("caption", "")
     buttons_raw = s.get("buttons", "")
     
     # Fallback to general API ID/Hash from accounts if not provided in schedule
-    if not api_id or not api_hash:
-        accounts = load_accounts()
-        if accounts:
-            api_id = accounts[0].get("api_id")
-            api_hash = accounts[0].get("api_hash")
+    api_id, api_hash = _bot_credentials(s)
     
     if not bot_token or not api_id or not api_hash:
         logging.error(f"Credentials missing (Bot Token or API ID/Hash) for schedule {s.get('id')}")
+        run_info["error"] = "MissingCredentials"
         return False
 
     client = None
     try:
-        os.makedirs(SESSIONS_FOLDER, exist_ok=True)
-        session_name = f"bot_{hashlib.md5(bot_token.encode()).hexdigest()[:10]}"
-        session_path = os.path.join(SESSIONS_FOLDER, session_name)
-        
-        client = TelegramClient(session_path, int(api_id), api_hash)
-        await client.start(bot_token=bot_token)
+        session_name = _bot_session_name(bot_token)
+        client = await start_bot_client(bot_token, api_id, api_hash)
         
         kb = []
         if buttons_raw:
@@ -819,19 +2028,39 @@ async def execute_schedule(s):
                     if len(parts) >= 2:
                         kb.append([Button.url(parts[0].strip(), parts[1].strip())])
         
-        if image_filename:
-            file_path = os.path.join(MEDIA_FOLDER, image_filename)
-            if os.path.exists(file_path):
-                await client.send_file(target, file_path, caption=caption, buttons=kb if kb else None)
+        if image_filename and not image_hash:
+            # Older schedules reference their image by media name only
+            index = load_media_index()
+            image_hash = index["media"].get(image_filename) or index["posted"].get(image_filename)
+
+        bio = None
+        if image_filename and image_hash and os.path.exists(_blob_path(image_hash)):
+            bio = await load_send_ready(image_hash, image_filename)
+
+        async def send(peer):
+            if bio is not None:
+                bio.seek(0)
+                await client.send_file(peer, bio, caption=caption, buttons=kb if kb else None)
+                run_info["bytes"] = run_info.get("bytes", 0) + len(bio.getbuffer())
             else:
-                await client.send_message(target, caption, buttons=kb if kb else None)
-        else:
-            await client.send_message(target, caption, buttons=kb if kb else None)
+                await client.send_message(peer, caption, buttons=kb if kb else None)
+                run_info["bytes"] = run_info.get("bytes", 0) + len(caption.encode("utf-8"))
+
+        peer = await resolve_schedule_target(client, session_name, target)
+        try:
+            await send(peer)
+        except STALE_PEER_ERRORS:
+            # Cached peer was rejected; resolve again once and retry
+            logging.info(f"Target cache untuk {target} tidak valid, resolve ulang")
+            forget_schedule_target(session_name, target)
+            peer = await resolve_schedule_target(client, session_name, target, refresh=True)
+            await send(peer)
             
         logging.info(f"Schedule {s.get('id')} sent successfully via Bot")
         return True
     except Exception as e:
         logging.error(f"Failed to execute bot schedule {s.get('id')}: {e}")
+        run_info["error"] = type(e).__name__
         return False
     finally:
         if client:
@@ -841,6 +2070,15 @@ async def execute_schedule(s):
 async def get_schedules():
     return load_json(SCHEDULES_FILE)
 
+@app.get("/schedules/stats")
+async def schedule_stats():
+    """p50/p95 fire-time drift and run duration per schedule"""
+    return get_schedule_stats()
+
+@app.get("/schedules/{sched_id}/history")
+async def schedule_history(sched_id: str):
+    return load_schedule_history().get(sched_id, [])
+
 @app.post("/schedules/")
 async def add_schedule(
     target: str = Form(...),
@@ -851,15 +2089,32 @@ async def add_schedule(
     buttons: str = Form(None),
     image: UploadFile = File(None)
 ):
+    # Validate the target once and warm the resolved-target cache
+    api_id, api_hash = _bot_credentials({})
+    if api_id and api_hash:
+        client = None
+        try:
+            client = await start_bot_client(bot_token, api_id, api_hash)
+        except Exception as e:
+            logging.warning(f"Tidak bisa menjalankan bot untuk memvalidasi target {target}: {e}")
+        if client:
+            try:
+                await resolve_schedule_target(client, _bot_session_name(bot_token), target, refresh=True)
+            except (ValueError, errors.UsernameInvalidError, errors.UsernameNotOccupiedError) as e:
+                raise HTTPException(status_code=400, detail=f"Target tidak ditemukan: {str(e)}")
+            except Exception as e:
+                logging.warning(f"Tidak bisa memvalidasi target {target}: {e}")
+            finally:
+                await client.disconnect()
+
     schedules = load_json(SCHEDULES_FILE)
     new_id = hashlib.md5(f"{target}{time}{random.random()}".encode()).hexdigest()[:8]
     
     image_filename = None
+    image_hash = None
     if image:
-        image_filename = f"sched_{new_id}_{image.filename}"
-        img_path = os.path.join(MEDIA_FOLDER, image_filename)
-        with open(img_path, "wb") as f:
-            f.write(await image.read())
+        image_filename = os.path.basename(image.filename)
+        image_hash = put_blob_bytes(await image.read())
     
     new_sched = {
         "id": new_id,
@@ -868,6 +2123,7 @@ async def add_schedule(
         "repeat": repeat,
         "caption": caption,
         "image_filename": image_filename,
+        "image_hash": image_hash,
         "bot_token": bot_token,
         "buttons": buttons,
         "active": True,
@@ -889,11 +2145,10 @@ async def test_bot_message(
     # Temporary ID for log and image
     test_id = f"test_{int(time.time())}"
     image_filename = None
+    image_hash = None
     if image:
-        image_filename = f"test_{test_id}_{image.filename}"
-        img_path = os.path.join(MEDIA_FOLDER, image_filename)
-        with open(img_path, "wb") as f:
-            f.write(await image.read())
+        image_filename = os.path.basename(image.filename)
+        image_hash = put_blob_bytes(await image.read())
 
     mock_schedule = {
         "id": test_id,
@@ -901,15 +2156,14 @@ async def test_bot_message(
         "caption": caption,
         "bot_token": bot_token,
         "image_filename": image_filename,
+        "image_hash": image_hash,
         "buttons": buttons
     }
     
     success = await execute_schedule(mock_schedule)
     
-    # Cleanup test image if created
-    if image_filename and os.path.exists(os.path.join(MEDIA_FOLDER, image_filename)):
-        try: os.remove(os.path.join(MEDIA_FOLDER, image_filename))
-        except: pass
+    # Cleanup test image unless the same bytes are referenced elsewhere
+    release_blob(image_hash)
 
     if success:
         return {"status": "Test berhasil! Pesan terkirim."}
@@ -923,6 +2177,12 @@ async def delete_schedule(sched_id: str):
     if len(filtered) == len(schedules):
         raise HTTPException(status_code=404, detail="Jadwal tidak ditemukan")
     save_json(SCHEDULES_FILE, filtered)
+    for s in schedules:
+        if s["id"] == sched_id:
+            release_blob(s.get("image_hash"))
+    history = load_schedule_history()
+    if history.pop(sched_id, None) is not None:
+        save_json(SCHEDULE_HISTORY_FILE, history)
     return {"status": "Jadwal berhasil dihapus"}
 
 @app.get("/bot-settings/")
@@ -934,6 +2194,271 @@ async def save_bot_settings(data: dict):
     save_json(BOT_SETTINGS_FILE, data)
     return {"status": "Berhasil disimpan"}
 
+# ----- Background Jobs -----
+# Long maintenance work runs on JOB_CONCURRENCY in-process workers instead of inside
+# a request handler. Job records are persisted in JOBS_FILE; handlers report
+# progress with report_job_progress() and can be cancelled between steps.
+JOB_TYPES = {}            # type name -> async handler(job_id, params) -> result dict
+
+
+def job_type(name: str):
+    def register(fn):
+        JOB_TYPES[name] = fn
+        return fn
+    return register
+
+
+def _save_jobs():
+    records = sorted(jobs.values(), key=lambda j: j["created"])
+    if len(records) > JOBS_HISTORY_LIMIT:
+        # Drop the oldest finished jobs first
+        finished = [j for j in records if j["status"] in ("done", "failed", "cancelled")]
+        for j in finished[:len(records) - JOBS_HISTORY_LIMIT]:
+            jobs.pop(j["id"], None)
+        records = sorted(jobs.values(), key=lambda j: j["created"])
+    save_json(JOBS_FILE, records)
+
+
+def load_jobs():
+    """Load job records; work interrupted by a restart is failed or re-queued."""
+    jobs.clear()
+    for j in load_json(JOBS_FILE):
+        if j.get("status") == "running":
+            j["status"] = "failed"
+            j["error"] = "Dihentikan karena server restart"
+            j["finished"] = time.time()
+        jobs[j["id"]] = j
+    _save_jobs()
+
+
+def submit_job(type_name: str, params: dict) -> dict:
+    job_id = hashlib.md5(f"{type_name}{time.time()}{random.random()}".encode()).hexdigest()[:10]
+    job = {
+        "id": job_id,
+        "type": type_name,
+        "params": params,
+        "status": "queued",
+        "progress": {"done": 0, "total": 0},
+        "result": None,
+        "error": "",
+        "created": time.time(),
+        "started": None,
+        "finished": None,
+        "cancel_requested": False,
+    }
+    jobs[job_id] = job
+    _save_jobs()
+    job_queue.put_nowait(job_id)
+    return job
+
+
+def report_job_progress(job_id: str, done: int, total: int):
+    global _last_progress_save
+    job = jobs.get(job_id)
+    if not job:
+        return
+    job["progress"] = {"done": done, "total": total}
+    # Progress lives in memory; persist it at most once per second
+    if time.time() - _last_progress_save >= 1:
+        _last_progress_save = time.time()
+        _save_jobs()
+
+
+async def _run_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job or job["status"] != "queued":
+        return
+    if shutdown_event is not None and shutdown_event.is_set():
+        # Leave it queued; it is picked up again on the next start
+        return
+    handler = JOB_TYPES.get(job["type"])
+    if handler is None:
+        job["status"] = "failed"
+        job["error"] = f"Tipe job tidak dikenal: {job['type']}"
+        job["finished"] = time.time()
+        _save_jobs()
+        return
+    job["status"] = "running"
+    job["started"] = time.time()
+    _save_jobs()
+    task = asyncio.ensure_future(handler(job_id, job.get("params") or {}))
+    job_tasks[job_id] = task
+    try:
+        async with track_inflight():
+            job["result"] = await task
+        job["status"] = "done"
+    except asyncio.CancelledError:
+        job["status"] = "cancelled"
+        job["error"] = "" if job["cancel_requested"] else "Dihentikan saat shutdown"
+        if not task.done():
+            task.cancel()
+        if not job["cancel_requested"]:
+            raise
+    except Exception as e:
+        logging.error(f"Job {job_id} ({job['type']}) gagal: {e}")
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job_tasks.pop(job_id, None)
+        job["finished"] = time.time()
+        _save_jobs()
+
+
+async def _job_worker():
+    while True:
+        job_id = await job_queue.get()
+        try:
+            await _run_job(job_id)
+        finally:
+            job_queue.task_done()
+
+
+def start_job_workers():
+    global job_queue
+    job_queue = asyncio.Queue()
+    load_jobs()
+    for j in sorted(jobs.values(), key=lambda j: j["created"]):
+        if j["status"] == "queued":
+            job_queue.put_nowait(j["id"])
+    for _ in range(JOB_CONCURRENCY):
+        job_workers.append(asyncio.create_task(_job_worker()))
+
+
+async def stop_job_workers():
+    for w in job_workers:
+        w.cancel()
+    await asyncio.gather(*job_workers, return_exceptions=True)
+    job_workers.clear()
+
+
+def _referenced_blobs() -> set:
+    """Hashes referenced by media, posted entries and schedules."""
+    index = load_media_index()
+    referenced = set(index["media"].values()) | set(index["posted"].values())
+    referenced |= {s.get("image_hash") for s in load_json(SCHEDULES_FILE) if s.get("image_hash")}
+    return referenced
+
+
+@job_type("rehash_media")
+async def job_rehash_media(job_id: str, params: dict) -> dict:
+    """Verify every referenced blob against its hash. With remove_orphans, also
+    delete blobs that nothing references, plus thumbnails and send-ready variants
+    left behind by blobs that are gone."""
+    job_started = time.time()
+    digests = sorted(_referenced_blobs())
+    loop = asyncio.get_running_loop()
+    missing, corrupt = [], []
+    for i, digest in enumerate(digests):
+        path = _blob_path(digest)
+        if not os.path.exists(path):
+            missing.append(digest)
+        elif await loop.run_in_executor(None, _sha256_of_file, path) != digest:
+            corrupt.append(digest)
+        report_job_progress(job_id, i + 1, len(digests))
+
+    removed = 0
+    if params.get("remove_orphans"):
+        # Re-read references right before deleting, with no await in between, so
+        # blobs stored while hashing are kept. Blobs newer than the job are skipped
+        # too (e.g. a test send whose blob is not referenced anywhere yet).
+        referenced = _referenced_blobs()
+        for sub in os.listdir(BLOBS_FOLDER):
+            sub_path = os.path.join(BLOBS_FOLDER, sub)
+            if sub == "tmp" or not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                path = os.path.join(sub_path, name)
+                if name in referenced or name.endswith(".tmp") or os.path.getmtime(path) >= job_started:
+                    continue
+                os.remove(path)
+                removed += 1
+        # Spool files left behind by interrupted uploads; recent ones may still be in use
+        tmp_dir = os.path.join(BLOBS_FOLDER, "tmp")
+        if os.path.isdir(tmp_dir):
+            for name in os.listdir(tmp_dir):
+                path = os.path.join(tmp_dir, name)
+                if os.path.getmtime(path) < job_started - 3600:
+                    os.remove(path)
+        for folder in (THUMBS_FOLDER, OPTIMIZED_FOLDER):
+            for name in list(_load_disk_lru(folder)):
+                digest = name.split("_")[0].split(".")[0]
+                if not os.path.exists(_blob_path(digest)):
+                    _drop_cached_files(folder, digest)
+    return {"checked": len(digests), "missing": missing, "corrupt": corrupt, "orphans_removed": removed}
+
+
+@job_type("sync_media_inbox")
+async def job_sync_media_inbox(job_id: str, params: dict) -> dict:
+    """Ingest image files dropped into the media/ and mark-posted/ inboxes."""
+    ingested = await sync_media_folders()
+    report_job_progress(job_id, ingested, ingested)
+    return {"ingested": ingested}
+
+
+@job_type("mark_posted_bulk")
+async def job_mark_posted_bulk(job_id: str, params: dict) -> dict:
+    """Mark many (file, caption) items as posted. items: [{"file": ..., "caption": ...}]"""
+    items = params.get("items") or []
+    failed = []
+    for i, item in enumerate(items):
+        if not mark_posted_entry(item.get("file"), item.get("caption", "")):
+            failed.append(item.get("file"))
+        report_job_progress(job_id, i + 1, len(items))
+        await asyncio.sleep(0)
+    return {"marked": len(items) - len(failed), "failed": failed}
+
+
+@job_type("reindex_send_errors")
+async def job_reindex_send_errors(job_id: str, params: dict) -> dict:
+    """Classify legacy failures in the send log and rebuild the error index."""
+    # No awaits between load and save, so sends logged meanwhile cannot be lost
+    analytics = load_analytics()
+    sends = analytics.get("sends", [])
+    for send in sends:
+        if not send.get("success") and send.get("error_code") not in SEND_ERROR_CODES:
+            send["error_code"], send["flood_seconds"] = _classify_error_message(send.get("error_message", ""))
+    analytics["error_index"] = _build_error_index(sends)
+    save_analytics(analytics)
+    report_job_progress(job_id, len(sends), len(sends))
+    return {"sends": len(sends), "failed": sum(len(r) for r in analytics["error_index"].values())}
+
+
+@app.get("/jobs/")
+async def list_jobs():
+    return sorted(jobs.values(), key=lambda j: j["created"], reverse=True)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job tidak ditemukan")
+    return job
+
+@app.post("/jobs/")
+async def create_job(data: dict):
+    type_name = data.get("type")
+    if type_name not in JOB_TYPES:
+        raise HTTPException(status_code=400, detail=f"Tipe job tidak dikenal. Pilihan: {', '.join(sorted(JOB_TYPES))}")
+    return submit_job(type_name, data.get("params") or {})
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job tidak ditemukan")
+    if job["status"] not in ("queued", "running"):
+        raise HTTPException(status_code=400, detail=f"Job sudah {job['status']}")
+    job["cancel_requested"] = True
+    if job["status"] == "queued":
+        job["status"] = "cancelled"
+        job["finished"] = time.time()
+        _save_jobs()
+    else:
+        task = job_tasks.get(job_id)
+        if task:
+            task.cancel()
+    return {"status": "Job dibatalkan", "id": job_id}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="127.0.0.1", port=8374, reload=True)
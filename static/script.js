@@ -14,6 +14,7 @@ const CLEAR_ANALYTICS_API = '/analytics/clear/';
 const SCHEDULE_API = '/schedules/';
 const BOT_SETTINGS_API = '/bot-settings/';
 const TEST_BOT_API = '/test-bot-message/';
+const UPLOAD_MEDIA_BATCH_API = '/upload-media-batch/';
 
 // ----- GLOBAL VARIABLES -----
 let accounts = [];
@@ -1376,16 +1377,23 @@ async function uploadSelectedMedia() {
     status.className = 'form-alert show info';
 
     try {
+        // Send all selected files in a single multipart request
+        const fd = new FormData();
         for (let i = 0; i < input.files.length; i++) {
-            const file = input.files[i];
-            const fd = new FormData();
-            fd.append('file', file);
-            const res = await fetch('/upload-media/', { method: 'POST', body: fd });
-            const result = await res.json();
-            if (!res.ok) {
-                showAlert(status, `Gagal upload ${file.name}: ${result.detail || 'error'}`, 'error');
-                return;
-            }
+            fd.append('files', input.files[i]);
+        }
+        const res = await fetch(UPLOAD_MEDIA_BATCH_API, { method: 'POST', body: fd });
+        const result = await res.json();
+        if (!res.ok) {
+            showAlert(status, `Gagal upload: ${result.detail || 'error'}`, 'error');
+            return;
+        }
+        const failed = (result.results || []).filter(r => r.status === 'error');
+        if (failed.length) {
+            const names = failed.map(r => `${r.file} (${r.detail || 'error'})`).join(', ');
+            showAlert(status, `Gagal upload ${failed.length} file: ${names}`, 'error');
+            await loadMedia();
+            return;
         }
 
         showAlert(status, 'Semua file berhasil diupload', 'success');